@@ -1,12 +1,15 @@
  #  Start by making sure the `websocket-client` and `pyaudio` packages are installed.
 # If not, you can install it by running the following command:
 # pip install websocket-client pyaudio supabase python-dotenv
+# Optional (faster JSON): pip install "orjson>=3.9"
 
 import os
 import ssl
+import sys
 import pyaudio
 import websocket
 import json
+import queue
 import threading
 import time
 import wave
@@ -28,6 +31,23 @@ except ImportError:
     SUPABASE_AVAILABLE = False
     print("Warning: supabase package not installed. Run: pip install supabase")
 
+# orjson is optional but much faster than the stdlib json module
+try:
+    import orjson
+    from orjson import loads as json_loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    orjson = None
+    from json import loads as json_loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
+
+# orjson >= 3.9 can embed already-serialized JSON in a larger document without re-dumping it
+JSON_FRAGMENT = getattr(orjson, 'Fragment', None)
+
 # Replace with your chosen API key, this is the "default" account api key
 API_KEY = "api"
 
@@ -35,17 +55,26 @@ API_KEY = "api"
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")  # Add your Supabase URL
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")  # Add your Supabase anon/service key
 SUPABASE_TABLE = "transcripts"  # Table name in Supabase
+SUPABASE_BATCH_SIZE = 50  # Max rows per bulk insert
+SUPABASE_FLUSH_INTERVAL = 2  # Flush pending rows at least every 2 seconds
+SUPABASE_SPILL_FILE = "supabase_failed_uploads.jsonl"  # Rows that failed to upload
 
 # Auto-save configuration
 AUTO_SAVE_INTERVAL = 60  # Save JSON file every 1 minute (in seconds)
 AUTO_SAVE_TRANSCRIPT_COUNT = 50  # Or save after 50 transcripts, whichever comes first
 
+# Console output
+LIVE_FLUSH_EVERY = 3  # Flush stdout every 3 partial (LIVE) transcripts
+
 CONNECTION_PARAMS = {
     "sample_rate": 16000,
     "format_turns": True,
     "enable_extra_session_information": True,
     "entity_detection": True  # Enable brand/entity detection
 }
+
+# Entity types reported as brands
+BRAND_TYPES = frozenset({'organization', 'product', 'brand', 'company'})
 API_ENDPOINT_BASE_URL = "wss://streaming.assemblyai.com/v3/ws"
 API_ENDPOINT = f"{API_ENDPOINT_BASE_URL}?{urlencode(CONNECTION_PARAMS)}"
 
@@ -54,32 +83,100 @@ FRAMES_PER_BUFFER = 800  # 50ms of audio (0.05s * 16000Hz)
 SAMPLE_RATE = CONNECTION_PARAMS["sample_rate"]
 CHANNELS = 1
 FORMAT = pyaudio.paInt16
+AUDIO_RING_SLOTS = 64  # Chunks buffered between capture and sender (power of two, ~3.2s)
 
 # Global variables for audio stream and websocket
 audio = None
 stream = None
 ws_app = None
-audio_thread = None
-stop_event = threading.Event()  # To signal the audio thread to stop
+audio_sender_thread = None
+stop_event = threading.Event()  # To signal the audio callback and background threads to stop
 
-# WAV recording variables
-recorded_frames = []  # Store audio frames for WAV file
-recording_lock = threading.Lock()  # Thread-safe access to recorded_frames
+# WAV recording variables (frames are written to disk as they arrive)
+wav_writer = None
+wav_filename = None
+recorded_bytes = 0
 
 # Transcript storage
 transcript_data = []  # Temporary storage for periodic JSON saves
 transcript_lock = threading.Lock()
+save_cv = threading.Condition(transcript_lock)  # Wakes the auto-save thread
 session_start_time = None
 session_id = None
 last_save_time = None
 transcript_count = 0
+live_update_count = 0
+
+# Session transcript file (JSONL, appended on every save)
+transcripts_file = None
+transcripts_filename = None
+transcripts_saved = 0
+transcripts_file_lock = threading.RLock()  # Serializes saves; RLock since a final save also closes
 
 # Supabase client
 supabase_client = None
 
+# Supabase upload queue (drained in bulk by the flush thread)
+supabase_queue = queue.Queue()
+supabase_flush_thread = None
+
 # Auto-save thread
 auto_save_thread = None
 
+class AudioRingBuffer:
+    """Single-producer/single-consumer ring of audio chunks.
+
+    The PortAudio callback is the only writer of ``head`` and the sender thread
+    the only writer of ``tail``; each publishes by rebinding its own int, so the
+    index handoff itself is lock-free. Waking the sender is Event-gated, and
+    ``data_ready.set()``/``clear()`` briefly take the Event's internal lock.
+    When the ring is full new chunks are dropped (and counted) instead of
+    blocking the capture callback.
+    """
+
+    def __init__(self, slots, chunk_size):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.mask = slots - 1
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(slots * chunk_size)
+        self.lengths = [0] * slots
+        self.head = 0  # Next slot to write (producer)
+        self.tail = 0  # Next slot to read (consumer)
+        self.dropped = 0
+        self.data_ready = threading.Event()
+
+    def push(self, data):
+        """Copy data into the ring, splitting it into chunk_size pieces if needed."""
+        for offset in range(0, len(data), self.chunk_size):
+            if self.head - self.tail > self.mask:
+                self.dropped += 1
+                continue
+            piece = data[offset:offset + self.chunk_size]
+            slot = self.head & self.mask
+            start = slot * self.chunk_size
+            self.buffer[start:start + len(piece)] = piece
+            self.lengths[slot] = len(piece)
+            self.head += 1  # Publish the slot only after it is written
+        self.data_ready.set()
+
+    def pop(self, timeout=None):
+        """Return the oldest chunk, or None if nothing arrives within timeout."""
+        if self.tail == self.head:
+            self.data_ready.clear()
+            # Re-check after clearing so a push between the two checks is not missed
+            if self.tail == self.head and timeout:
+                self.data_ready.wait(timeout)
+            if self.tail == self.head:
+                return None
+        slot = self.tail & self.mask
+        start = slot * self.chunk_size
+        data = bytes(self.buffer[start:start + self.lengths[slot]])
+        self.tail += 1  # Release the slot back to the producer
+        return data
+
+audio_ring = AudioRingBuffer(AUDIO_RING_SLOTS, FRAMES_PER_BUFFER * CHANNELS * 2)
+
 # --- WebSocket Event Handlers ---
 
 def on_open(ws):
@@ -99,41 +196,61 @@ def on_open(ws):
             supabase_client = None
     else:
         print("⚠️  Supabase not configured - only local JSON saves will work")
+
+    # Start Supabase flush thread
+    if supabase_client:
+        start_supabase_flush_thread()
     
     # Start auto-save thread
     start_auto_save_thread()
 
-    # Start sending audio data in a separate thread
-    def stream_audio():
-        global stream
-        print("Starting audio streaming...")
-        while not stop_event.is_set():
-            try:
-                audio_data = stream.read(FRAMES_PER_BUFFER, exception_on_overflow=False)
-
-                # Store audio data for WAV recording
-                with recording_lock:
-                    recorded_frames.append(audio_data)
-
-                # Send audio data as binary message
-                ws.send(audio_data, websocket.ABNF.OPCODE_BINARY)
-            except Exception as e:
-                print(f"Error streaming audio: {e}")
-                # If stream read fails, likely means it's closed, stop the loop
-                break
-        print("Audio streaming stopped.")
+    # Open the WAV file that audio is recorded into
+    open_wav_file()
 
-    global audio_thread
-    audio_thread = threading.Thread(target=stream_audio)
-    audio_thread.daemon = (
-        True  # Allow main thread to exit even if this thread is running
-    )
-    audio_thread.start()
+    # Send captured audio from a separate thread so a slow socket never stalls capture
+    def send_audio():
+        print("Starting audio streaming...")
+        try:
+            while not stop_event.is_set():
+                audio_data = audio_ring.pop(timeout=0.1)
+                if audio_data is None:
+                    continue
+                try:
+                    # Send audio data as binary message
+                    ws.send(audio_data, websocket.ABNF.OPCODE_BINARY)
+
+                    # Append audio data to the WAV recording
+                    write_wav_frames(audio_data)
+                except Exception as e:
+                    print(f"Error streaming audio: {e}")
+                    break
+        finally:
+            # This thread is the ring's only consumer and the WAV writer's only user,
+            # so it records what is still queued and finalizes the file itself
+            while (audio_data := audio_ring.pop()) is not None:
+                write_wav_frames(audio_data)
+            close_wav_file()
+            print("Audio streaming stopped.")
+
+    global audio_sender_thread
+    audio_sender_thread = threading.Thread(target=send_audio, daemon=True)
+    audio_sender_thread.start()
+
+    # Start the microphone stream; PortAudio delivers chunks to on_audio
+    stream.start_stream()
+
+def on_audio(in_data, frame_count, time_info, status):
+    """PyAudio stream callback: hand each captured chunk to the sender thread."""
+    if stop_event.is_set():
+        return (None, pyaudio.paComplete)
+
+    audio_ring.push(in_data)
+    return (None, pyaudio.paContinue)
 
 def on_message(ws, message):
-    global session_id, session_start_time, transcript_count
+    global session_id, session_start_time, transcript_count, live_update_count
     try:
-        data = json.loads(message)
+        data = json_loads(message)
         msg_type = data.get('type')
 
         if msg_type == "Begin":
@@ -149,44 +266,65 @@ def on_message(ws, message):
             entities = data.get('entities', [])
 
             if formatted and transcript.strip():  # Only process non-empty formatted transcripts
+                now = datetime.now()
+
                 # Extract brands from entities
-                brands = []
-                for entity in entities:
-                    entity_type = entity.get('entity_type', '').lower()
-                    if entity_type in ['organization', 'product', 'brand', 'company']:
-                        brands.append({
-                            'name': entity.get('text'),
-                            'type': entity_type,
-                            'confidence': entity.get('confidence', 0)
-                        })
+                brands = [
+                    {
+                        'name': entity.get('text'),
+                        'type': entity_type,
+                        'confidence': entity.get('confidence', 0)
+                    }
+                    for entity in entities
+                    for entity_type in (entity.get('entity_type', '').lower(),)
+                    if entity_type in BRAND_TYPES
+                ]
                 
+                # With Supabase on, serialize brands/entities once: the strings fill the
+                # Supabase columns and (via orjson.Fragment) go into the JSONL line as-is
+                brands_json = entities_json = None
+                saved_brands, saved_entities = brands, entities
+                if supabase_client:
+                    brands_json = json_dumps(brands)
+                    entities_json = json_dumps(entities)
+                    if JSON_FRAGMENT:
+                        saved_brands = JSON_FRAGMENT(brands_json)
+                        saved_entities = JSON_FRAGMENT(entities_json)
+
                 # Create structured transcript entry
                 transcript_entry = {
-                    'timestamp': datetime.now().isoformat(),
+                    'timestamp': now.isoformat(),
                     'session_id': session_id,
                     'transcript': transcript,
-                    'brands': brands,
-                    'entities': entities,
-                    'word_count': len(transcript.split())
+                    'brands': saved_brands,
+                    'entities': saved_entities,
+                    'word_count': transcript.strip().count(' ') + 1  # transcript is non-empty here
                 }
                 
                 # Store in memory for periodic saves
-                with transcript_lock:
+                with save_cv:
                     transcript_data.append(transcript_entry)
                     transcript_count += 1
+                    if transcript_count >= AUTO_SAVE_TRANSCRIPT_COUNT:
+                        save_cv.notify()
                 
-                # Upload to Supabase immediately
-                upload_to_supabase_realtime(transcript_entry)
+                # Queue for Supabase upload
+                upload_to_supabase_realtime(transcript_entry, brands_json, entities_json)
                 
-                # Display
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] {transcript}")
+                # Display (built as one string so it is a single write)
+                output = f"\n[{now.strftime('%H:%M:%S')}] {transcript}\n"
                 if brands:
                     brand_names = ', '.join([b['name'] for b in brands])
-                    print(f"  🏷️  BRANDS: {brand_names}")
+                    output += f"  🏷️  BRANDS: {brand_names}\n"
+                sys.stdout.write(output)
+                sys.stdout.flush()
                 
             else:
                 # Live updates (partial transcripts)
-                print(f"\r[LIVE] {transcript}", end='', flush=True)
+                sys.stdout.write(f"\r[LIVE] {transcript}")
+                live_update_count += 1
+                if live_update_count % LIVE_FLUSH_EVERY == 0:
+                    sys.stdout.flush()
                 
         elif msg_type == "Termination":
             audio_duration = data.get('audio_duration_seconds', 0)
@@ -208,15 +346,16 @@ def on_close(ws, close_status_code, close_msg):
     """Called when the WebSocket connection is closed."""
     print(f"\nWebSocket Disconnected: Status={close_status_code}, Msg={close_msg}")
 
-    # Final save of any remaining transcripts
-    save_json_file(final=True)
-    
-    # Save recorded audio to WAV file
-    save_wav_file()
-
     # Ensure audio resources are released
     global stream, audio
-    stop_event.set()  # Signal audio thread and auto-save thread to stop
+    stop_event.set()  # Signal audio callback and auto-save thread to stop
+    with save_cv:
+        save_cv.notify()
+
+    # Let an in-flight auto-save finish, then do the final save of any remaining transcripts
+    if auto_save_thread and auto_save_thread.is_alive():
+        auto_save_thread.join(timeout=5.0)
+    save_json_file(final=True)
 
     if stream:
         if stream.is_active():
@@ -226,29 +365,90 @@ def on_close(ws, close_status_code, close_msg):
     if audio:
         audio.terminate()
         audio = None
-    # Try to join the audio thread to ensure clean exit
-    if audio_thread and audio_thread.is_alive():
-        audio_thread.join(timeout=1.0)
 
-def upload_to_supabase_realtime(transcript_entry):
-    """Upload a single transcript to Supabase immediately."""
+    # The sender thread drains the ring and finalizes the WAV file on exit
+    if audio_sender_thread and audio_sender_thread.is_alive():
+        audio_sender_thread.join(timeout=1.0)
+    if audio_sender_thread and audio_sender_thread.is_alive():
+        print("⚠️  Audio sender still busy - WAV file will be finalized when it finishes")
+    else:
+        close_wav_file()  # No-op if the sender already closed it
+    if audio_ring.dropped:
+        print(f"⚠️  Dropped {audio_ring.dropped} audio chunks (sender fell behind)")
+
+    # Upload whatever is still queued for Supabase
+    if supabase_flush_thread and supabase_flush_thread.is_alive():
+        supabase_flush_thread.join(timeout=SUPABASE_FLUSH_INTERVAL + 1)
+    flush_supabase_queue()
+
+def upload_to_supabase_realtime(transcript_entry, brands_json, entities_json):
+    """Queue a single transcript (with pre-serialized brands/entities) for the next bulk Supabase insert."""
     if not supabase_client:
         return  # Skip if not configured
-    
+
+    data = {
+        'session_id': transcript_entry['session_id'],
+        'timestamp': transcript_entry['timestamp'],
+        'transcript': transcript_entry['transcript'],
+        'brands': brands_json,
+        'entities': entities_json,
+        'word_count': transcript_entry['word_count']
+    }
+    supabase_queue.put(data)
+
+def insert_supabase_rows(rows):
+    """Insert a batch of rows with one request, spilling them to disk on failure."""
     try:
-        data = {
-            'session_id': transcript_entry['session_id'],
-            'timestamp': transcript_entry['timestamp'],
-            'transcript': transcript_entry['transcript'],
-            'brands': json.dumps(transcript_entry['brands']),
-            'entities': json.dumps(transcript_entry['entities']),
-            'word_count': transcript_entry['word_count']
-        }
-        supabase_client.table(SUPABASE_TABLE).insert(data).execute()
+        supabase_client.table(SUPABASE_TABLE).insert(rows).execute()
     except Exception as e:
-        # Silently log errors to avoid cluttering output
-        pass  # You can uncomment below for debugging
-        # print(f"\n⚠️  Supabase upload error: {e}")
+        print(f"\n⚠️  Supabase upload error: {e} - {len(rows)} rows saved to {SUPABASE_SPILL_FILE}")
+        try:
+            with open(SUPABASE_SPILL_FILE, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json_dumps(row) + "\n")
+        except Exception as spill_error:
+            print(f"\n❌ Error writing {SUPABASE_SPILL_FILE}: {spill_error}")
+
+def flush_supabase_queue():
+    """Drain the Supabase queue completely (used on shutdown)."""
+    if not supabase_client:
+        return
+
+    rows = []
+    while True:
+        try:
+            rows.append(supabase_queue.get_nowait())
+        except queue.Empty:
+            break
+        if len(rows) >= SUPABASE_BATCH_SIZE:
+            insert_supabase_rows(rows)
+            rows = []
+    if rows:
+        insert_supabase_rows(rows)
+
+def start_supabase_flush_thread():
+    """Start background thread that bulk-inserts queued transcripts."""
+    global supabase_flush_thread
+
+    def supabase_flush_loop():
+        while not stop_event.is_set():
+            # Collect up to SUPABASE_BATCH_SIZE rows or whatever arrives within the interval
+            rows = []
+            deadline = time.time() + SUPABASE_FLUSH_INTERVAL
+            while len(rows) < SUPABASE_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(supabase_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if rows:
+                insert_supabase_rows(rows)
+
+    supabase_flush_thread = threading.Thread(target=supabase_flush_loop, daemon=True)
+    supabase_flush_thread.start()
 
 def start_auto_save_thread():
     """Start background thread for periodic JSON saves."""
@@ -257,8 +457,20 @@ def start_auto_save_thread():
     def auto_save_loop():
         global last_save_time, transcript_count
         while not stop_event.is_set():
-            time.sleep(5)  # Check every 5 seconds
-            
+            # Sleep until the interval elapses or on_message signals the count threshold.
+            # transcript_count only counts new arrivals, so after a failed save the
+            # retry waits a full interval unless enough new transcripts come in.
+            # stop_event is re-checked under the lock: on_close sets it before taking the
+            # lock to notify, so a stop can't slip in between the check and the wait.
+            with save_cv:
+                remaining = AUTO_SAVE_INTERVAL - (time.time() - last_save_time)
+                if (not stop_event.is_set() and remaining > 0
+                        and transcript_count < AUTO_SAVE_TRANSCRIPT_COUNT):
+                    save_cv.wait(timeout=remaining)
+
+            if stop_event.is_set():
+                break
+
             current_time = time.time()
             time_elapsed = current_time - last_save_time
             
@@ -268,80 +480,168 @@ def start_auto_save_thread():
                 transcript_count >= AUTO_SAVE_TRANSCRIPT_COUNT
             )
             
-            if should_save and transcript_data:
-                save_json_file(final=False)
+            if should_save:
+                save_json_file(final=False, current_time=current_time)
+                # Restart the interval even when there was nothing to save
                 last_save_time = current_time
     
     auto_save_thread = threading.Thread(target=auto_save_loop, daemon=True)
     auto_save_thread.start()
 
-def save_json_file(final=False):
-    """Save transcripts to a JSON file and clear memory."""
-    global transcript_count
-    
-    if not transcript_data:
-        return
+def save_json_file(final=False, current_time=None):
+    """Append buffered transcripts to the session's JSONL file and clear memory.
 
-    # Generate filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"transcripts_{timestamp}.json"
+    current_time is the caller's time.time() reading, reused to avoid another clock call.
+    Returns False if the write failed (the entries are kept for the next save).
+    Holds transcripts_file_lock so the auto-save thread and on_close never overlap.
+    """
+    global transcript_data, transcript_count, transcripts_file, transcripts_filename, transcripts_saved
 
-    try:
+    with transcripts_file_lock:
+        if not transcript_data:
+            if final:
+                close_transcripts_file()
+            return True
+
+        # Swap in an empty buffer so on_message keeps appending while we write
         with transcript_lock:
-            output_data = {
-                'metadata': {
-                    'session_id': session_id,
-                    'session_start': session_start_time.isoformat() if session_start_time else None,
-                    'file_created': datetime.now().isoformat(),
-                    'total_transcripts': len(transcript_data),
-                    'is_final': final
-                },
-                'transcripts': transcript_data.copy()  # Copy current data
-            }
+            entries, transcript_data = transcript_data, []
+            transcript_count = 0
+
+        now = datetime.fromtimestamp(current_time) if current_time else datetime.now()
+
+        append_offset = None
+        try:
+            # Open the session file once; later saves only append new entries
+            if transcripts_file is None:
+                start = session_start_time or now
+                transcripts_filename = f"transcripts_{start.strftime('%Y%m%d_%H%M%S')}.jsonl"
+                transcripts_file = open(transcripts_filename, 'a', encoding='utf-8')
+
+            # Serialize the whole batch before writing so a bad entry can't leave a partial append
+            lines = ''.join(json_dumps(entry) + "\n" for entry in entries)
+            append_offset = os.path.getsize(transcripts_filename)
+            transcripts_file.write(lines)
+            transcripts_file.flush()
 
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"\n❌ Error saving JSON file: {e}")
+            # Drop anything partially written so the retry doesn't duplicate entries
+            if append_offset is not None:
+                try:
+                    transcripts_file.close()
+                except Exception:
+                    pass
+                transcripts_file = None  # Reopened by the next save
+                try:
+                    os.truncate(transcripts_filename, append_offset)
+                except OSError:
+                    pass
+            # Put the entries back so the next save retries them. transcript_count is
+            # left alone: it counts new arrivals, and retries must not re-arm that trigger.
+            with transcript_lock:
+                transcript_data[:0] = entries
+            if final:
+                close_transcripts_file()
+            return False
+
+        # The entries are on disk now; a metadata failure must not re-queue them
+        transcripts_saved += len(entries)
+        try:
+            write_transcripts_metadata(final, now)
+        except Exception as e:
+            print(f"\n❌ Error saving metadata file: {e}")
 
         status = "FINAL" if final else "AUTO-SAVE"
         print(f"\n\n{'='*60}")
-        print(f"💾 [{status}] JSON saved: {filename}")
-        print(f"📊 Transcripts in file: {len(transcript_data)}")
+        print(f"💾 [{status}] JSONL updated: {transcripts_filename}")
+        print(f"📊 Transcripts appended: {len(entries)} (total: {transcripts_saved})")
         print(f"{'='*60}\n")
 
-        # Clear memory after successful save (but not on final save)
-        if not final:
-            with transcript_lock:
-                transcript_data.clear()
-                transcript_count = 0
+        if final:
+            close_transcripts_file()
+        return True
+
+def write_transcripts_metadata(final, now):
+    """Write session metadata to a sidecar file next to the JSONL transcripts."""
+    metadata = {
+        'session_id': session_id,
+        'session_start': session_start_time.isoformat() if session_start_time else None,
+        'transcripts_file': transcripts_filename,
+        'last_updated': now.isoformat(),
+        'total_transcripts': transcripts_saved,
+        'is_final': final
+    }
+    meta_filename = transcripts_filename.replace('.jsonl', '_meta.json')
+    with open(meta_filename, 'w', encoding='utf-8') as f:
+        f.write(json_dumps(metadata))
+
+def close_transcripts_file():
+    """Close the session's JSONL file, marking its metadata as final."""
+    global transcripts_file
+
+    with transcripts_file_lock:
+        if transcripts_file is None:
+            return
 
-    except Exception as e:
-        print(f"\n❌ Error saving JSON file: {e}")
+        try:
+            write_transcripts_metadata(True, datetime.now())
+            transcripts_file.close()
+        except Exception as e:
+            print(f"\n❌ Error closing JSON file: {e}")
+        finally:
+            transcripts_file = None
 
-def save_wav_file():
-    """Save recorded audio frames to a WAV file."""
-    if not recorded_frames:
-        print("No audio data recorded.")
-        return
+def open_wav_file():
+    """Open a timestamped WAV file that audio frames are streamed into."""
+    global wav_writer, wav_filename, recorded_bytes
 
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"recorded_audio_{timestamp}.wav"
+    wav_filename = f"recorded_audio_{timestamp}.wav"
+    recorded_bytes = 0
 
     try:
-        with wave.open(filename, 'wb') as wf:
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(2)  # 16-bit = 2 bytes
-            wf.setframerate(SAMPLE_RATE)
+        wav_writer = wave.open(wav_filename, 'wb')
+        wav_writer.setnchannels(CHANNELS)
+        wav_writer.setsampwidth(2)  # 16-bit = 2 bytes
+        wav_writer.setframerate(SAMPLE_RATE)
+    except Exception as e:
+        print(f"Error opening WAV file: {e}")
+        wav_writer = None
 
-            # Write all recorded frames
-            with recording_lock:
-                wf.writeframes(b''.join(recorded_frames))
+def write_wav_frames(audio_data):
+    """Append a chunk of audio to the open WAV file."""
+    global recorded_bytes
+
+    if not wav_writer:
+        return
+    # writeframesraw skips the per-call header rewrite; close() patches the header once
+    wav_writer.writeframesraw(audio_data)
+    recorded_bytes += len(audio_data)
 
-        print(f"🎵 Audio saved to: {filename}")
-        print(f"Duration: {len(recorded_frames) * FRAMES_PER_BUFFER / SAMPLE_RATE:.2f} seconds")
+def close_wav_file():
+    """Finalize the WAV header and close the recording."""
+    global wav_writer
 
+    if not wav_writer:
+        return
+
+    try:
+        wav_writer.close()
     except Exception as e:
         print(f"Error saving WAV file: {e}")
+        return
+    finally:
+        wav_writer = None
+
+    if not recorded_bytes:
+        print("No audio data recorded.")
+        os.remove(wav_filename)
+        return
+
+    print(f"🎵 Audio saved to: {wav_filename}")
+    print(f"Duration: {recorded_bytes / (2 * CHANNELS * SAMPLE_RATE):.2f} seconds")
 
 # --- Main Execution ---
 def run():
@@ -366,6 +666,8 @@ def run():
             channels=CHANNELS,
             format=FORMAT,
             rate=SAMPLE_RATE,
+            stream_callback=on_audio,
+            start=False,  # Started in on_open once the WebSocket is connected
         )
         print("Microphone stream opened successfully.")
         print("Speak into your microphone. Press Ctrl+C to stop.")
@@ -397,7 +699,7 @@ def run():
             time.sleep(0.1)
     except KeyboardInterrupt:
         print("\nCtrl+C received. Stopping...")
-        stop_event.set()  # Signal audio thread to stop
+        stop_event.set()  # Signal audio callback to stop
 
         # Send termination message to the server
         if ws_app and ws_app.sock and ws_app.sock.connected:
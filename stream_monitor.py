@@ -9,10 +9,18 @@ Usage: python3 stream_monitor.py
 
 import subprocess
 import os
+import io
 import time
 import json
-import tempfile
+import re
+import select
+import threading
+import wave
 import requests
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
@@ -34,19 +42,64 @@ N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL", "")
 # Segment duration in seconds
 SEGMENT_DURATION = 30
 
-# Keep MP3 files after processing? (for debugging)
+# Worker threads that transcribe/detect/send while the next segment is captured
+PIPELINE_WORKERS = 3
+
+# Segments sent to Whisper in one request (higher = fewer API calls, more latency)
+BATCH_SEGMENTS = max(1, int(os.getenv("BATCH_SEGMENTS", "1")))
+
+# Keep audio segment files after processing? (for debugging)
 KEEP_AUDIO_FILES = os.getenv("KEEP_AUDIO_FILES", "false").lower() == "true"
 
 # Output directory for audio files (if keeping them)
 OUTPUT_DIR = Path("audio_segments")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Capture format: 16-bit mono PCM at 16kHz (what Whisper resamples to anyway)
+SAMPLE_RATE = 16000
+SEGMENT_BYTES = SEGMENT_DURATION * SAMPLE_RATE * 2
+
 # Groq API endpoints
 GROQ_WHISPER_URL = "https://api.groq.com/openai/v1/audio/transcriptions"
 GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
 
+# Pulls the JSON object out of the model's reply (in case it adds extra text)
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
 # =======================================
 
+# Reuse keep-alive connections instead of a new TCP+TLS handshake per request.
+# requests.Session isn't documented as thread-safe, so each worker thread gets
+# its own. Groq and n8n use separate sessions so the API key never reaches the webhook.
+thread_sessions = threading.local()
+
+# Outbound webhook calls run here so a slow n8n never holds up the pipeline
+http_pool = ThreadPoolExecutor(max_workers=4)
+
+# Long-running ffmpeg capture process
+capture_process = None
+capture_stderr_thread = None
+capture_stderr_tail = deque(maxlen=5)  # Last ffmpeg log lines, reported if it exits
+
+
+def get_groq_session():
+    """Return this thread's Groq session (created on first use)."""
+    session = getattr(thread_sessions, 'groq', None)
+    if session is None:
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {GROQ_API_KEY}'
+        thread_sessions.groq = session
+    return session
+
+
+def get_n8n_session():
+    """Return this thread's n8n session (created on first use)."""
+    session = getattr(thread_sessions, 'n8n', None)
+    if session is None:
+        session = requests.Session()
+        thread_sessions.n8n = session
+    return session
+
 
 def check_dependencies():
     """Check if required dependencies are installed."""
@@ -74,86 +127,191 @@ def check_dependencies():
     return True
 
 
-def capture_audio_segment(segment_number):
-    """Capture a single audio segment from the stream."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # Create temporary file or permanent file based on config
-    if KEEP_AUDIO_FILES:
-        output_path = OUTPUT_DIR / f"segment_{timestamp}_{segment_number:04d}.mp3"
-    else:
-        # Use temporary file that will be auto-deleted
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        output_path = Path(temp_file.name)
-        temp_file.close()
-    
-    # FFmpeg command
+def start_capture():
+    """Launch one long-running ffmpeg process that decodes the stream to PCM on stdout."""
+    global capture_process, capture_stderr_thread
+
+    # FFmpeg command (raw 16-bit PCM is read from the pipe, nothing touches the disk)
     ffmpeg_cmd = [
         'ffmpeg',
         '-i', STREAM_URL,
-        '-t', str(SEGMENT_DURATION),
-        '-acodec', 'libmp3lame',
-        '-b:a', '128k',
-        '-ar', '16000',  # 16kHz for speech recognition
-        '-ac', '1',      # Mono
-        '-y',
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),  # 16kHz for speech recognition
+        '-ac', '1',               # Mono
         '-loglevel', 'error',
-        str(output_path)
+        'pipe:1'
     ]
-    
+
+    capture_process = subprocess.Popen(
+        ffmpeg_cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    # Keep draining stderr: decoder errors on a glitchy stream would otherwise
+    # fill the pipe buffer and block ffmpeg mid-session
+    capture_stderr_tail.clear()
+    capture_stderr_thread = threading.Thread(
+        target=drain_stderr,
+        args=(capture_process.stderr,),
+        daemon=True
+    )
+    capture_stderr_thread.start()
+
+
+def drain_stderr(pipe):
+    """Read ffmpeg's stderr until EOF, keeping only the most recent lines."""
+    for line in pipe:
+        capture_stderr_tail.append(line.decode(errors='replace').rstrip())
+
+
+def stop_capture():
+    """Stop the ffmpeg capture process (it is restarted on the next capture)."""
+    global capture_process, capture_stderr_thread
+
+    if capture_process is None:
+        return
+
+    if capture_process.poll() is None:
+        capture_process.terminate()
+        try:
+            capture_process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            capture_process.kill()
+            capture_process.wait()
+
+    # stderr reaches EOF once ffmpeg is gone; close the pipes so restarts don't leak fds
+    if capture_stderr_thread is not None:
+        capture_stderr_thread.join(timeout=1)
+        capture_stderr_thread = None
+    capture_process.stdout.close()
+    capture_process.stderr.close()
+    capture_process = None
+
+
+def read_pcm(num_bytes, timeout):
+    """Read num_bytes of PCM from ffmpeg's stdout; returns fewer only if ffmpeg exits."""
+    fd = capture_process.stdout.fileno()
+    pcm = bytearray()
+    deadline = time.time() + timeout
+
+    while len(pcm) < num_bytes:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            continue
+        chunk = os.read(fd, num_bytes - len(pcm))
+        if not chunk:
+            break  # EOF - ffmpeg exited
+        pcm += chunk
+
+    return pcm
+
+
+def pcm_to_wav(pcm):
+    """Wrap raw 16-bit mono PCM in an in-memory WAV container."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)  # 16-bit = 2 bytes
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def capture_audio_segment(segment_number):
+    """Read the next segment of raw PCM from the running ffmpeg process."""
     try:
-        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, timeout=SEGMENT_DURATION + 10)
-        
-        if result.returncode == 0 and output_path.exists():
-            return output_path
-        else:
-            print(f"   ❌ FFmpeg error: {result.stderr}")
-            return None
-            
-    except subprocess.TimeoutExpired:
+        if capture_process is None:
+            start_capture()
+
+        pcm = read_pcm(SEGMENT_BYTES, timeout=SEGMENT_DURATION + 10)
+
+        if len(pcm) < SEGMENT_BYTES:
+            stop_capture()
+            error = '\n'.join(capture_stderr_tail)
+            print(f"   ❌ FFmpeg exited: {error or 'no error output'}")
+            # Keep whatever was decoded before ffmpeg stopped
+            if not pcm:
+                return None
+
+        if KEEP_AUDIO_FILES:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = OUTPUT_DIR / f"segment_{timestamp}_{segment_number:04d}.wav"
+            output_path.write_bytes(pcm_to_wav(pcm))
+
+        return bytes(pcm)
+
+    except TimeoutError:
         print("   ❌ FFmpeg timeout")
+        stop_capture()
         return None
     except Exception as e:
         print(f"   ❌ Capture error: {e}")
+        stop_capture()
         return None
 
 
-def transcribe_with_groq(audio_path):
-    """Transcribe audio using Groq Whisper API."""
+def transcribe_with_groq(audio, filename):
+    """Transcribe WAV audio bytes using Groq Whisper API.
+
+    Returns Whisper's timestamped segments (dicts with 'start' and 'text'),
+    or None on failure.
+    """
     try:
-        with open(audio_path, 'rb') as audio_file:
-            files = {
-                'file': (audio_path.name, audio_file, 'audio/mpeg'),
-            }
-            data = {
-                'model': 'whisper-large-v3-turbo',
-                'response_format': 'json',
-                'language': 'en'  # Adjust if needed
-            }
-            headers = {
-                'Authorization': f'Bearer {GROQ_API_KEY}'
-            }
-            
-            response = requests.post(
-                GROQ_WHISPER_URL,
-                files=files,
-                data=data,
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('text', '')
-            else:
-                print(f"   ❌ Groq Whisper error: {response.status_code} - {response.text}")
-                return None
+        files = {
+            'file': (filename, audio, 'audio/wav'),
+        }
+        data = {
+            'model': 'whisper-large-v3-turbo',
+            'response_format': 'verbose_json',
+            'timestamp_granularities[]': 'segment',
+            'language': 'en'  # Adjust if needed
+        }
+        
+        response = get_groq_session().post(
+            GROQ_WHISPER_URL,
+            files=files,
+            data=data,
+            timeout=30 * BATCH_SEGMENTS
+        )
+        
+        if response.status_code == 200:
+            result = response.json()
+            if 'segments' in result:
+                return result['segments']
+            return [{'start': 0, 'text': result.get('text', '')}]
+        else:
+            print(f"   ❌ Groq Whisper error: {response.status_code} - {response.text}")
+            return None
                 
     except Exception as e:
         print(f"   ❌ Transcription error: {e}")
         return None
 
 
+def split_transcript(whisper_segments, durations):
+    """Split Whisper segments back into one transcript per captured segment.
+
+    Each Whisper segment is assigned to the captured segment its start time
+    falls in; durations are the captured segment lengths in seconds.
+    """
+    starts = list(accumulate(durations[:-1], initial=0))
+    parts = [[] for _ in durations]
+
+    for segment in whisper_segments:
+        index = bisect_right(starts, segment.get('start', 0)) - 1
+        text = segment.get('text', '').strip()
+        if text:
+            parts[index].append(text)
+
+    return [' '.join(texts) for texts in parts]
+
+
 def extract_brands_with_llama(transcript):
     """Extract brand names using Llama via Groq."""
     try:
@@ -189,15 +347,9 @@ Important: Return ONLY the JSON object, no other text."""
             "max_tokens": 500
         }
         
-        headers = {
-            'Authorization': f'Bearer {GROQ_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        response = requests.post(
+        response = get_groq_session().post(
             GROQ_CHAT_URL,
             json=payload,
-            headers=headers,
             timeout=30
         )
         
@@ -208,8 +360,7 @@ Important: Return ONLY the JSON object, no other text."""
             # Parse the JSON response
             try:
                 # Try to extract JSON from the response
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
+                json_match = JSON_OBJECT_RE.search(content)
                 if json_match:
                     brands_data = json.loads(json_match.group())
                     return brands_data.get('brands', [])
@@ -227,98 +378,119 @@ Important: Return ONLY the JSON object, no other text."""
         return []
 
 
-def send_to_n8n(data):
-    """Send results to n8n webhook."""
-    if not N8N_WEBHOOK_URL:
-        return False
-    
+def post_to_n8n(data):
+    """Post results to the n8n webhook (runs on http_pool)."""
+    tag = f"[#{data['segment_number']}]"
+
     try:
-        response = requests.post(
+        response = get_n8n_session().post(
             N8N_WEBHOOK_URL,
             json=data,
             timeout=10
         )
         
         if response.status_code in [200, 201]:
+            print(f"{tag} 📤 Sent to n8n ✅")
             return True
         else:
-            print(f"   ⚠️  n8n webhook error: {response.status_code}")
+            print(f"{tag} ⚠️  n8n webhook error: {response.status_code}")
             return False
             
     except Exception as e:
-        print(f"   ⚠️  n8n send error: {e}")
+        print(f"{tag} ⚠️  n8n send error: {e}")
         return False
 
 
-def process_segment(segment_number):
-    """Process a single audio segment: capture, transcribe, extract brands, send to n8n."""
-    timestamp = datetime.now()
-    
-    print(f"\n{'='*70}")
-    print(f"🎬 Processing Segment #{segment_number}")
-    print(f"⏰ {timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"{'='*70}")
-    
-    # Step 1: Capture audio
-    print("📻 Capturing audio...", end=' ', flush=True)
-    audio_path = capture_audio_segment(segment_number)
-    if not audio_path:
-        print("Failed!")
-        return False
-    file_size = audio_path.stat().st_size / 1024
-    print(f"✅ ({file_size:.1f} KB)")
-    
-    # Step 2: Transcribe
-    print("🎤 Transcribing...", end=' ', flush=True)
-    transcript = transcribe_with_groq(audio_path)
-    if not transcript:
-        print("Failed!")
-        if not KEEP_AUDIO_FILES:
-            audio_path.unlink()
+def send_to_n8n(data):
+    """Queue results for the n8n webhook without waiting for the response."""
+    if not N8N_WEBHOOK_URL:
+        return None
+
+    return http_pool.submit(post_to_n8n, data)
+
+
+def process_batch(batch):
+    """Transcribe a batch of captured segments with one Whisper request, then process each.
+
+    batch is a list of (segment_number, pcm, timestamp) tuples captured back to
+    back, so their audio can simply be concatenated.
+    """
+    first, last = batch[0][0], batch[-1][0]
+    tag = f"[#{first}]" if first == last else f"[#{first}-{last}]"
+
+    try:
+        # Step 2: Transcribe
+        audio = pcm_to_wav(b''.join(pcm for _, pcm, _ in batch))
+        whisper_segments = transcribe_with_groq(audio, f"segment_{first:04d}.wav")
+        if whisper_segments is None:
+            print(f"{tag} 🎤 Transcription failed!")
+            return False
+
+        durations = [len(pcm) / (2 * SAMPLE_RATE) for _, pcm, _ in batch]
+        transcripts = split_transcript(whisper_segments, durations)
+
+    except Exception as e:
+        print(f"{tag} ❌ Processing error: {e}")
         return False
-    print(f"✅")
-    print(f"   📝 \"{transcript[:100]}{'...' if len(transcript) > 100 else ''}\"")
-    
-    # Step 3: Extract brands
-    print("🏷️  Detecting brands...", end=' ', flush=True)
-    brands = extract_brands_with_llama(transcript)
-    print(f"✅ (Found {len(brands)})")
-    if brands:
-        brand_names = [b['name'] for b in brands]
-        print(f"   🔖 {', '.join(brand_names)}")
-    
-    # Step 4: Send to n8n
-    data = {
-        "timestamp": timestamp.isoformat(),
-        "segment_number": segment_number,
-        "transcript": transcript,
-        "brands": brands,
-        "stream_url": STREAM_URL,
-        "duration_seconds": SEGMENT_DURATION
-    }
-    
-    if N8N_WEBHOOK_URL:
-        print("📤 Sending to n8n...", end=' ', flush=True)
-        if send_to_n8n(data):
-            print("✅")
-        else:
-            print("Failed!")
-    
-    # Cleanup audio file if not keeping
-    if not KEEP_AUDIO_FILES and audio_path.exists():
-        audio_path.unlink()
-    
-    print(f"{'='*70}\n")
+
+    for (segment_number, _, timestamp), transcript, duration in zip(batch, transcripts, durations):
+        process_segment(segment_number, transcript, timestamp, duration)
+
     return True
 
 
+def process_segment(segment_number, transcript, timestamp, duration):
+    """Process a transcribed audio segment: extract brands, send to n8n.
+
+    Runs on a pipeline worker while the next segment is being captured, so every
+    line it prints is tagged with the segment number.
+    """
+    tag = f"[#{segment_number}]"
+
+    try:
+        if not transcript:
+            print(f"{tag} 🎤 No speech detected")
+            return False
+        print(f"{tag} 🎤 \"{transcript[:100]}{'...' if len(transcript) > 100 else ''}\"")
+
+        # Step 3: Extract brands
+        brands = extract_brands_with_llama(transcript)
+        print(f"{tag} 🏷️  Found {len(brands)} brands")
+        if brands:
+            brand_names = [b['name'] for b in brands]
+            print(f"{tag} 🔖 {', '.join(brand_names)}")
+
+        # Step 4: Send to n8n
+        data = {
+            "timestamp": timestamp.isoformat(),
+            "segment_number": segment_number,
+            "transcript": transcript,
+            "brands": brands,
+            "stream_url": STREAM_URL,
+            "duration_seconds": round(duration, 2)
+        }
+
+        send_to_n8n(data)
+
+        return True
+
+    except Exception as e:
+        print(f"{tag} ❌ Processing error: {e}")
+        return False
+
+
 def run_monitor():
-    """Main monitoring loop."""
+    """Main monitoring loop.
+
+    Capture stays on the main thread while transcription, brand detection and
+    the n8n upload run on a thread pool, so API latency overlaps the next capture.
+    """
     print("\n" + "="*70)
     print("🎙️  RADIO STREAM MONITOR")
     print("="*70)
     print(f"📻 Stream: {STREAM_URL}")
     print(f"⏱️  Segment Duration: {SEGMENT_DURATION} seconds")
+    print(f"📦 Segments per Whisper request: {BATCH_SEGMENTS}")
     print(f"🤖 Transcription: Groq Whisper (whisper-large-v3-turbo)")
     print(f"🧠 Brand Detection: Llama 3.3 70B via Groq")
     print(f"📤 n8n Webhook: {'✅ Configured' if N8N_WEBHOOK_URL else '❌ Not configured'}")
@@ -327,20 +499,44 @@ def run_monitor():
     print("\nPress Ctrl+C to stop\n")
     
     segment_number = 0
+    batch = []
+    executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
     
     try:
         while True:
             segment_number += 1
+            timestamp = datetime.now()
             
+            print(f"\n{'='*70}")
+            print(f"🎬 Segment #{segment_number} ⏰ {timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"{'='*70}")
+            
+            # Step 1: Capture audio
             start_time = time.time()
-            process_segment(segment_number)
-            elapsed = time.time() - start_time
+            pcm = capture_audio_segment(segment_number)
+            if not pcm:
+                print(f"[#{segment_number}] 📻 Capture failed!")
+                # Small delay to avoid hammering the stream
+                elapsed = time.time() - start_time
+                if elapsed < 2:
+                    time.sleep(2 - elapsed)
+                continue
+            
+            print(f"[#{segment_number}] 📻 Captured ({len(pcm) / 1024:.1f} KB)")
+            batch.append((segment_number, pcm, timestamp))
             
-            # Small delay to avoid hammering the stream
-            if elapsed < 2:
-                time.sleep(2 - elapsed)
+            # Steps 2-4 run in the background while the next segments are captured
+            if len(batch) >= BATCH_SEGMENTS:
+                executor.submit(process_batch, batch)
+                batch = []
                 
     except KeyboardInterrupt:
+        stop_capture()
+        print("\n⏳ Finishing segments already captured...")
+        if batch:
+            executor.submit(process_batch, batch)
+        executor.shutdown(wait=True)
+        http_pool.shutdown(wait=True)
         print("\n\n" + "="*70)
         print("🛑 Monitor stopped")
         print(f"📊 Total segments processed: {segment_number}")